@@ -1,12 +1,18 @@
 import os
+import sys
 import json
 import time
+import asyncio
+import threading
+import concurrent.futures
 import datetime
 import urllib.parse
 import base64
+import hashlib
+import hmac
+import http.client
 import urllib.request
-import urllib.error
-from typing import Any, Dict, List, Optional, Tuple
+from typing import Any, Dict, List, Optional, Tuple, Union
 
 
 # =========================
@@ -27,45 +33,176 @@ SLACK_CHANNEL_ID = os.getenv("SLACK_CHANNEL_ID", "").strip()
 # Otherwise it will resolve "me" from the Zendesk credentials provided.
 ZENDESK_ASSIGNEE_ID_OVERRIDE = os.getenv("ZENDESK_ASSIGNEE_ID_OVERRIDE", "").strip()
 
+# How long the user id resolved from the Zendesk credentials is cached in the state file
+ME_CACHE_TTL_DAYS = float(os.getenv("ME_CACHE_TTL_DAYS", "30"))
+
+# Concurrency / pacing for Zendesk API calls
+ZENDESK_CONCURRENCY = int(os.getenv("ZENDESK_CONCURRENCY", "8"))
+# Start pacing requests once Zendesk reports fewer than this many calls left in the window
+ZENDESK_RATE_LIMIT_LOW_WATER = int(os.getenv("ZENDESK_RATE_LIMIT_LOW_WATER", "10"))
+
+# Slack allows at most 50 blocks per message; one is used for the header
+SLACK_MAX_SECTIONS_PER_MESSAGE = 49
+
 # Optional filters
 INCLUDE_TAGS = [t.strip() for t in os.getenv("INCLUDE_TAGS", "").split(",") if t.strip()]
 EXCLUDE_TAGS = [t.strip() for t in os.getenv("EXCLUDE_TAGS", "").split(",") if t.strip()]
+INCLUDE_TAG_SET = frozenset(INCLUDE_TAGS)
+EXCLUDE_TAG_SET = frozenset(EXCLUDE_TAGS)
 
 
 # =========================
 # Small HTTP helper
 # =========================
+class RateLimiter:
+    """
+    Thread-safe adaptive pacing driven by Zendesk's rate-limit headers. Requests go
+    straight through while X-Rate-Limit-Remaining shows headroom; below `low_water`
+    they are spaced evenly across the per-minute window, and a 429 pauses every
+    caller until Retry-After has passed.
+    """
+
+    def __init__(self, low_water: int = 10):
+        self.low_water = low_water
+        self.limit: Optional[int] = None
+        self.remaining: Optional[int] = None
+        self.next_allowed = 0.0
+        self.lock = threading.Lock()
+
+    def acquire(self) -> None:
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.next_allowed)
+            if self.remaining is not None and self.remaining < self.low_water:
+                self.next_allowed = slot + 60.0 / max(self.limit or 60, 1)
+            wait = slot - now
+        if wait > 0:
+            time.sleep(wait)
+
+    def update(self, resp: http.client.HTTPResponse) -> None:
+        limit = resp.getheader("X-Rate-Limit")
+        remaining = resp.getheader("X-Rate-Limit-Remaining")
+        with self.lock:
+            if limit and limit.isdigit():
+                self.limit = int(limit)
+            if remaining and remaining.isdigit():
+                self.remaining = int(remaining)
+
+    def pause(self, seconds: float) -> None:
+        with self.lock:
+            self.next_allowed = max(self.next_allowed, time.monotonic() + seconds)
+
+
+_local = threading.local()
+
+
+def get_connection(scheme: str, netloc: str, timeout: int) -> http.client.HTTPConnection:
+    # One keep-alive connection per host per thread, reused across requests
+    conns = _local.__dict__.setdefault("conns", {})
+    conn = conns.get((scheme, netloc))
+    if conn is None:
+        conn_cls = http.client.HTTPSConnection if scheme == "https" else http.client.HTTPConnection
+        proxy = proxy_for(scheme, netloc)
+        if proxy is None:
+            conn = conn_cls(netloc, timeout=timeout)
+        else:
+            # Honour HTTPS_PROXY / HTTP_PROXY / NO_PROXY like urllib does, via a CONNECT tunnel
+            conn = conn_cls(proxy.netloc.rpartition("@")[2], timeout=timeout)
+            tunnel_headers = {}
+            if proxy.username:
+                creds = f"{urllib.parse.unquote(proxy.username)}:{urllib.parse.unquote(proxy.password or '')}"
+                tunnel_headers["Proxy-Authorization"] = "Basic " + base64.b64encode(creds.encode("utf-8")).decode("ascii")
+            conn.set_tunnel(netloc, headers=tunnel_headers)
+        conns[(scheme, netloc)] = conn
+    return conn
+
+
+def proxy_for(scheme: str, netloc: str) -> Optional[urllib.parse.SplitResult]:
+    proxy_url = urllib.request.getproxies().get(scheme)
+    if not proxy_url or urllib.request.proxy_bypass(netloc):
+        return None
+    if "://" not in proxy_url:
+        proxy_url = f"http://{proxy_url}"
+    return urllib.parse.urlsplit(proxy_url)
+
+
+def drop_connection(scheme: str, netloc: str) -> None:
+    conn = _local.__dict__.get("conns", {}).pop((scheme, netloc), None)
+    if conn is not None:
+        conn.close()
+
+
 def http_request_json(
     method: str,
     url: str,
     headers: Dict[str, str],
     body: Optional[Dict[str, Any]] = None,
     timeout: int = 30,
+    max_retries: int = 3,
+    rate_limiter: Optional[RateLimiter] = None,
 ) -> Dict[str, Any]:
     data = None
     if body is not None:
-        data = json.dumps(body).encode("utf-8")
+        data = json.dumps(body, separators=(",", ":")).encode("utf-8")
         headers = {**headers, "Content-Type": "application/json; charset=utf-8"}
 
-    req = urllib.request.Request(url=url, data=data, method=method, headers=headers)
-    try:
-        with urllib.request.urlopen(req, timeout=timeout) as resp:
-            raw = resp.read().decode("utf-8")
-            if not raw:
-                return {}
-            return json.loads(raw)
-    except urllib.error.HTTPError as e:
-        err_body = ""
+    parts = urllib.parse.urlsplit(url)
+    path = f"{parts.path}?{parts.query}" if parts.query else parts.path
+
+    for attempt in range(max_retries + 1):
+        if rate_limiter is not None:
+            rate_limiter.acquire()
+        conn = get_connection(parts.scheme, parts.netloc, timeout)
         try:
-            err_body = e.read().decode("utf-8")
+            conn.request(method, path, body=data, headers=headers)
+            resp = conn.getresponse()
+            raw = resp.read()
+        except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+            # The server closed an idle keep-alive connection; reconnect and retry.
+            # Only for GET: a dropped POST may already have been handled (e.g. a Slack post).
+            drop_connection(parts.scheme, parts.netloc)
+            if method == "GET" and attempt < max_retries:
+                continue
+            raise
         except Exception:
-            pass
-        raise RuntimeError(f"HTTP {e.code} error for {url}: {err_body}") from e
+            drop_connection(parts.scheme, parts.netloc)
+            raise
+
+        if resp.will_close:
+            drop_connection(parts.scheme, parts.netloc)
+        if rate_limiter is not None:
+            rate_limiter.update(resp)
+
+        if resp.status == 429 and attempt < max_retries:
+            # Rate limited: wait as long as the server asks before retrying
+            retry_after = retry_after_seconds(resp.getheader("Retry-After"))
+            if rate_limiter is not None:
+                rate_limiter.pause(retry_after)
+            else:
+                time.sleep(retry_after)
+            continue
+        if not 200 <= resp.status < 300:
+            # Redirects aren't followed; anything but 2xx is an error rather than an empty result
+            raise RuntimeError(f"HTTP {resp.status} error for {url}: {raw.decode('utf-8', errors='replace')}")
+
+        if not raw:
+            return {}
+        # json.loads accepts UTF-8 bytes directly; no separate decode pass
+        return json.loads(raw)
+
+
+def retry_after_seconds(value: Optional[str], default: float = 60.0) -> float:
+    # Retry-After is usually a number of seconds; fall back to a conservative default otherwise
+    try:
+        return max(float(value), 0.0) if value else default
+    except ValueError:
+        return default
 
 
 def iso_to_dt(s: str) -> datetime.datetime:
     # Zendesk timestamps look like: 2026-02-04T20:30:25Z
-    return datetime.datetime.strptime(s, "%Y-%m-%dT%H:%M:%SZ").replace(tzinfo=datetime.timezone.utc)
+    # fromisoformat is a C fast path; "Z" is only accepted natively from Python 3.11
+    return datetime.datetime.fromisoformat(s.replace("Z", "+00:00"))
 
 
 def dt_to_iso(dt: datetime.datetime) -> str:
@@ -76,6 +213,15 @@ def now_utc() -> datetime.datetime:
     return datetime.datetime.now(datetime.timezone.utc)
 
 
+def next_cursor_url(payload: Dict[str, Any]) -> Optional[str]:
+    # Cursor-based pagination: keep going while meta.has_more, following links.next
+    meta = payload.get("meta") or {}
+    links = payload.get("links") or {}
+    if not meta.get("has_more"):
+        return None
+    return links.get("next") or None
+
+
 # =========================
 # Zendesk client
 # =========================
@@ -93,38 +239,48 @@ class ZendeskClient:
             "Accept": "application/json",
             "User-Agent": "zendesk-ticket-watchdog/1.0",
         }
+        # Shared across worker threads so concurrent audit fetches stay within one budget
+        self.limiter = RateLimiter(ZENDESK_RATE_LIMIT_LOW_WATER)
+
+    def _get(self, url: str) -> Dict[str, Any]:
+        return http_request_json("GET", url, self.headers, rate_limiter=self.limiter)
 
     def get_me(self) -> Dict[str, Any]:
         url = f"{self.base}/api/v2/users/me.json"
-        return http_request_json("GET", url, self.headers)
+        return self._get(url)
 
-    def search_tickets(self, query: str, per_page: int = 100) -> List[Dict[str, Any]]:
-        # Handles pagination
+    def search_tickets(self, query: str, page_size: int = 1000) -> List[Dict[str, Any]]:
+        # Cursor-based pagination via the export endpoint (no 100-page / 1000-result cap);
+        # export allows up to 1000 results per page
         results: List[Dict[str, Any]] = []
-        url = f"{self.base}/api/v2/search.json?query={urllib.parse.quote(query)}&per_page={per_page}"
+        params = urllib.parse.urlencode(
+            {
+                "query": query,
+                "filter[type]": "ticket",
+                "page[size]": page_size,
+                # Side-load ticket metrics so "pending since" usually needs no audit calls
+                "include": "tickets(metric_sets)",
+            }
+        )
+        url = f"{self.base}/api/v2/search/export.json?{params}"
 
         while url:
-            payload = http_request_json("GET", url, self.headers)
-            items = payload.get("results", [])
-            results.extend(items)
-
-            next_page = payload.get("next_page")
-            url = next_page if next_page else None
-
-            # gentle throttle
-            time.sleep(0.2)
+            payload = self._get(url)
+            results.extend(payload.get("results", []))
+            url = next_cursor_url(payload)
 
         return results
 
-    def list_audits(self, ticket_id: int, per_page: int = 100) -> List[Dict[str, Any]]:
+    def list_audits(self, ticket_id: int, page_size: int = 100) -> List[Dict[str, Any]]:
+        # 100 is the maximum page size for ticket audits
         audits: List[Dict[str, Any]] = []
-        url = f"{self.base}/api/v2/tickets/{ticket_id}/audits.json?per_page={per_page}"
+        params = urllib.parse.urlencode({"page[size]": page_size})
+        url = f"{self.base}/api/v2/tickets/{ticket_id}/audits.json?{params}"
 
         while url:
-            payload = http_request_json("GET", url, self.headers)
+            payload = self._get(url)
             audits.extend(payload.get("audits", []))
-            url = payload.get("next_page")
-            time.sleep(0.2)
+            url = next_cursor_url(payload)
 
         return audits
 
@@ -146,9 +302,12 @@ class SlackClient:
             "User-Agent": "zendesk-ticket-watchdog/1.0",
         }
 
-    def post_message(self, channel: str, text: str) -> None:
+    def post_message(self, channel: str, text: str, blocks: Optional[List[Dict[str, Any]]] = None) -> None:
         url = "https://slack.com/api/chat.postMessage"
-        payload = {"channel": channel, "text": text, "unfurl_links": False, "unfurl_media": False}
+        payload: Dict[str, Any] = {"channel": channel, "text": text, "unfurl_links": False, "unfurl_media": False}
+        if blocks:
+            # `text` stays as the notification / fallback text
+            payload["blocks"] = blocks
         resp = http_request_json("POST", url, self.headers, payload)
 
         if not resp.get("ok"):
@@ -160,14 +319,26 @@ class SlackClient:
 # =========================
 def load_state(path: str) -> Dict[str, Any]:
     if not os.path.exists(path):
-        return {"alerts": {}}
-    with open(path, "r", encoding="utf-8") as f:
-        return json.load(f)
+        return {"alerts": {}, "pending_since": {}}
+    with open(path, "rb") as f:
+        return json.loads(f.read())
 
 
 def save_state(path: str, state: Dict[str, Any]) -> None:
-    with open(path, "w", encoding="utf-8") as f:
-        json.dump(state, f, indent=2, sort_keys=True)
+    # Write compact JSON to a temp file and swap it in, so a crash never leaves a partial file
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        # json.dumps uses the C encoder; json.dump streams through the pure-Python one
+        f.write(json.dumps(state, separators=(",", ":")))
+    os.replace(tmp_path, path)
+
+
+def prune_state(state: Dict[str, Any], max_age_hours: float) -> None:
+    # Drop alert records older than max_age_hours; past the cooldown they no longer affect anything
+    cutoff = now_utc() - datetime.timedelta(hours=max_age_hours)
+    alerts = state.setdefault("alerts", {})
+    for key in [k for k, v in alerts.items() if iso_to_dt(v) < cutoff]:
+        del alerts[key]
 
 
 def should_alert(state: Dict[str, Any], ticket_id: int, condition_key: str, cooldown_hours: float) -> bool:
@@ -193,54 +364,170 @@ def find_pending_since(audits: List[Dict[str, Any]]) -> Optional[datetime.dateti
     """
     Find the most recent time the ticket status changed to 'pending' using audits.
     We look for audit events where field_name == 'status' and value == 'pending'.
+    Zendesk returns audits oldest first, so scan from the end and stop at the first hit.
     """
-    pending_times: List[datetime.datetime] = []
-
-    for audit in audits:
-        created_at = audit.get("created_at")
-        if not created_at:
+    for audit in reversed(audits):
+        events = audit.get("events")
+        if not events:
             continue
-        audit_dt = iso_to_dt(created_at)
 
-        events = audit.get("events", [])
         for ev in events:
             if ev.get("field_name") == "status" and ev.get("value") == "pending":
-                pending_times.append(audit_dt)
+                created_at = audit.get("created_at")
+                if created_at:
+                    return iso_to_dt(created_at)
+                break
 
-    if not pending_times:
+    return None
+
+
+def pending_since_from_metrics(ticket: Dict[str, Any]) -> Optional[datetime.datetime]:
+    """
+    Use the side-loaded ticket metric set: for a ticket that is currently pending,
+    status_updated_at is when it moved into pending. Returns None if metrics are missing.
+    """
+    if ticket.get("status") != "pending":
         return None
-    pending_times.sort()
-    return pending_times[-1]
+    metric_set = ticket.get("metric_set") or {}
+    status_updated_at = metric_set.get("status_updated_at")
+    if not status_updated_at:
+        return None
+    return iso_to_dt(status_updated_at)
+
+
+def build_search_query(assignee_id: str, created_before: datetime.datetime) -> str:
+    # Note: Zendesk search syntax: assignee:<id> status:pending type:ticket
+    terms = [f"type:ticket assignee:{assignee_id} status:pending"]
+    # A ticket can't have been pending longer than it has existed, so anything created
+    # after the threshold cutoff can't be stale yet. (updated< would be wrong: unrelated
+    # updates move updated_at forward without resetting the pending time.)
+    terms.append(f"created<{dt_to_iso(created_before)}")
+    # Let Zendesk drop excluded tags server-side. A single include tag is pushed too;
+    # with several, Zendesk's semantics may not match "any of", so tags_match handles it.
+    if len(INCLUDE_TAGS) == 1:
+        terms.append(f"tags:{INCLUDE_TAGS[0]}")
+    terms.extend(f"-tags:{tag}" for tag in EXCLUDE_TAGS)
+    return " ".join(terms)
 
 
 def tags_match(ticket: Dict[str, Any]) -> bool:
-    tags = set(ticket.get("tags", []) or [])
-    if INCLUDE_TAGS:
-        if not any(t in tags for t in INCLUDE_TAGS):
-            return False
-    if EXCLUDE_TAGS:
-        if any(t in tags for t in EXCLUDE_TAGS):
-            return False
+    tags = ticket.get("tags") or ()
+    if INCLUDE_TAG_SET and INCLUDE_TAG_SET.isdisjoint(tags):
+        return False
+    if EXCLUDE_TAG_SET and not EXCLUDE_TAG_SET.isdisjoint(tags):
+        return False
     return True
 
 
+def slack_escape(text: str) -> str:
+    return text.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+
+
 def format_slack_alert(ticket: Dict[str, Any], ticket_url: str, pending_since: datetime.datetime, pending_hours: float) -> str:
     ticket_id = ticket.get("id")
-    subject = ticket.get("subject") or "(no subject)"
+    subject = slack_escape(ticket.get("subject") or "(no subject)")
     priority = ticket.get("priority") or "none"
 
     pending_since_str = pending_since.astimezone(datetime.timezone.utc).strftime("%Y-%m-%d %H:%M UTC")
 
     text = (
-        f":warning: Zendesk ticket needs an update (Pending > {int(HOURS_PENDING_THRESHOLD)}h)\n"
-        f"- Ticket: #{ticket_id} — {subject}\n"
+        f"*<{ticket_url}|#{ticket_id}>* — {subject}\n"
         f"- Priority: {priority}\n"
-        f"- Pending since: {pending_since_str} (~{pending_hours:.1f}h)\n"
-        f"- Link: {ticket_url}\n"
+        f"- Pending since: {pending_since_str} (~{pending_hours:.1f}h)"
     )
     return text
 
 
+def build_slack_alert_message(
+    alerts: List[Tuple[Dict[str, Any], str, datetime.datetime, float]],
+) -> Tuple[str, List[Dict[str, Any]]]:
+    """
+    Build one chat.postMessage body for several alerts: a header section plus one
+    section per ticket. Returns (fallback_text, blocks).
+    """
+    title = f":warning: {len(alerts)} Zendesk ticket(s) need an update (Pending > {int(HOURS_PENDING_THRESHOLD)}h)"
+    blocks: List[Dict[str, Any]] = [{"type": "section", "text": {"type": "mrkdwn", "text": title}}]
+    for ticket, ticket_url, pending_since, pending_hours in alerts:
+        text = format_slack_alert(ticket, ticket_url, pending_since, pending_hours)
+        blocks.append({"type": "section", "text": {"type": "mrkdwn", "text": text}})
+    return title, blocks
+
+
+def resolve_my_user_id(zd: ZendeskClient, state: Dict[str, Any]) -> str:
+    """
+    Return the user id behind the Zendesk credentials, cached in state for
+    ME_CACHE_TTL_DAYS so most runs skip the /users/me.json round trip.
+    """
+    # The state file is committed to the repo, so keep only an HMAC of the credentials keyed
+    # by the API token: it can't be brute-forced offline, and rotating the token invalidates it
+    fingerprint = hmac.new(
+        ZENDESK_API_TOKEN.encode("utf-8"), f"{ZENDESK_SUBDOMAIN}:{ZENDESK_EMAIL}".encode("utf-8"), hashlib.sha256
+    ).hexdigest()
+    cached = state.get("me") or {}
+    if cached.get("id") and cached.get("fingerprint") == fingerprint and cached.get("resolved_at"):
+        age = now_utc() - iso_to_dt(cached["resolved_at"])
+        if age < datetime.timedelta(days=ME_CACHE_TTL_DAYS):
+            return str(cached["id"])
+
+    me = zd.get_me()
+    user_id = str(me["user"]["id"])
+    state["me"] = {"id": user_id, "fingerprint": fingerprint, "resolved_at": dt_to_iso(now_utc())}
+    return user_id
+
+
+async def fetch_pending_since_all(
+    zd: ZendeskClient, tickets: List[Dict[str, Any]], state: Dict[str, Any]
+) -> List[Union[Optional[datetime.datetime], BaseException]]:
+    """
+    Resolve the pending-since time for each ticket, in the same order as `tickets`.
+    Side-loaded metrics are used when present; then the state cache, valid while the
+    ticket's updated_at is unchanged; otherwise audits are fetched concurrently
+    (bounded by ZENDESK_CONCURRENCY) and the cache is refreshed.
+    A ticket whose lookup failed gets its exception in place of a result.
+    """
+    loop = asyncio.get_running_loop()
+    cache = state.get("pending_since") or {}
+    fresh_cache: Dict[str, Dict[str, Optional[str]]] = {}
+    # A dedicated pool sized to the concurrency limit bounds in-flight audit fetches, and
+    # each worker keeps one keep-alive connection, so they share at most N connections
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=ZENDESK_CONCURRENCY, thread_name_prefix="zendesk")
+
+    async def process(t: Dict[str, Any]) -> Optional[datetime.datetime]:
+        pending_since = pending_since_from_metrics(t)
+        if pending_since:
+            return pending_since
+
+        key = str(t["id"])
+        updated_at = t.get("updated_at")
+        cached = cache.get(key)
+        # This comparison stands in for an If-Modified-Since request: an unchanged ticket
+        # skips the audits call entirely, and a changed one would never get a 304 anyway.
+        if updated_at and cached and cached.get("updated_at") == updated_at:
+            fresh_cache[key] = cached
+            cached_iso = cached.get("pending_since")
+            return iso_to_dt(cached_iso) if cached_iso else None
+
+        audits = await loop.run_in_executor(executor, zd.list_audits, int(t["id"]))
+        pending_since = find_pending_since(audits)
+        if updated_at:
+            fresh_cache[key] = {
+                "updated_at": updated_at,
+                "pending_since": dt_to_iso(pending_since) if pending_since else None,
+            }
+        return pending_since
+
+    with executor:
+        # One failed fetch shouldn't abort the run; the caller skips failed tickets
+        results = await asyncio.gather(*(process(t) for t in tickets), return_exceptions=True)
+    for t, result in zip(tickets, results):
+        key = str(t["id"])
+        if isinstance(result, BaseException) and key in cache:
+            fresh_cache[key] = cache[key]
+    # Only keep entries for tickets still pending, so the cache doesn't grow forever
+    state["pending_since"] = fresh_cache
+    return results
+
+
 def main() -> None:
     # Validate env
     if not SLACK_CHANNEL_ID:
@@ -254,25 +541,26 @@ def main() -> None:
     if ZENDESK_ASSIGNEE_ID_OVERRIDE:
         assignee_id = ZENDESK_ASSIGNEE_ID_OVERRIDE
     else:
-        me = zd.get_me()
-        assignee_id = str(me["user"]["id"])
+        assignee_id = resolve_my_user_id(zd, state)
 
     # Search tickets assigned to me in pending
-    # Note: Zendesk search syntax: assignee:<id> status:pending type:ticket
-    query = f"type:ticket assignee:{assignee_id} status:pending"
+    query = build_search_query(assignee_id, now_utc() - datetime.timedelta(hours=HOURS_PENDING_THRESHOLD))
 
     tickets = zd.search_tickets(query=query)
+    candidates = [t for t in tickets if tags_match(t)]
+    resolved = asyncio.run(fetch_pending_since_all(zd, candidates, state))
     stale_count = 0
     alerted_count = 0
+    failed_count = 0
+    condition_key = "pending48"
+    pending_alerts: List[Tuple[Dict[str, Any], str, datetime.datetime, float]] = []
 
-    for t in tickets:
-        if not tags_match(t):
-            continue
-
+    for t, pending_since in zip(candidates, resolved):
         ticket_id = int(t["id"])
-        audits = zd.list_audits(ticket_id)
-
-        pending_since = find_pending_since(audits)
+        if isinstance(pending_since, BaseException):
+            failed_count += 1
+            print(f"Failed to resolve pending time for ticket #{ticket_id}: {pending_since}")
+            continue
         if not pending_since:
             # Can't compute accurately; skip or fallback if you prefer
             continue
@@ -282,23 +570,29 @@ def main() -> None:
             continue
 
         stale_count += 1
-        condition_key = "pending48"
 
         if not should_alert(state, ticket_id, condition_key, ALERT_COOLDOWN_HOURS):
             continue
 
-        ticket_url = zd.ticket_link(ticket_id)
-        msg = format_slack_alert(t, ticket_url, pending_since, pending_hours)
-        slack.post_message(SLACK_CHANNEL_ID, msg)
-        mark_alerted(state, ticket_id, condition_key)
-        alerted_count += 1
+        pending_alerts.append((t, zd.ticket_link(ticket_id), pending_since, pending_hours))
 
-        # slight throttle to be polite to Slack API
-        time.sleep(0.2)
+    # One Slack message per batch of tickets instead of one per ticket
+    for start in range(0, len(pending_alerts), SLACK_MAX_SECTIONS_PER_MESSAGE):
+        batch = pending_alerts[start:start + SLACK_MAX_SECTIONS_PER_MESSAGE]
+        text, blocks = build_slack_alert_message(batch)
+        slack.post_message(SLACK_CHANNEL_ID, text, blocks)
+        for t, _, _, _ in batch:
+            mark_alerted(state, int(t["id"]), condition_key)
+            alerted_count += 1
 
+    prune_state(state, ALERT_COOLDOWN_HOURS * 2)
     save_state(STATE_FILE, state)
 
-    print(f"Checked {len(tickets)} pending tickets. Stale={stale_count}. Alerts_sent={alerted_count}.")
+    print(f"Checked {len(tickets)} pending tickets. Stale={stale_count}. Alerts_sent={alerted_count}. Failed={failed_count}.")
+
+    # Alerts and state are already saved; still fail the job so lookup errors aren't silent
+    if failed_count:
+        sys.exit(f"Could not resolve pending time for {failed_count} ticket(s).")
 
 
 if __name__ == "__main__":